@@ -1,10 +1,25 @@
-import json
+import hashlib
 import os
+import re
 import logging
-from six.moves.urllib.request import urlopen
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
-from flask import Flask, request, jsonify, _request_ctx_stack
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from jose.utils import base64url_decode
+
+from flask import Flask, g, request, _request_ctx_stack
+from flask_caching import Cache
 from flask_cors import cross_origin
 from jose import jwt
 from random import randint, randrange
@@ -19,37 +34,231 @@ app = Flask(__name__)
 from werkzeug.middleware.proxy_fix import ProxyFix
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
+# In-process cache used for the static /public response
+cache = Cache(app, config={'CACHE_TYPE': 'simple', 'CACHE_DEFAULT_TIMEOUT': 300})
+
 # Provide the B2C Tenant name, specify the non-MFA B2C Policy name, and the API client id
 TENANT_NAME = os.getenv('B2C_DIR')
 TENANT_ID = os.getenv('TENANT_ID')
 B2C_POLICY = os.getenv('B2C_POLICY', default = 'B2C_1_signupsignin1')
 CLIENT_ID = os.getenv('CLIENT_ID')
 
+# Constant for the process lifetime; build these once instead of
+# re-concatenating the same strings on every request
+JWKS_URL = (f"https://{TENANT_NAME}.b2clogin.com/"
+            f"{TENANT_NAME}.onmicrosoft.com/"
+            f"{B2C_POLICY}/discovery/v2.0/keys")
+ISSUER = f"https://{TENANT_NAME}.b2clogin.com/{TENANT_ID}/v2.0/"
+
 # Enable logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-# Function to load the accounts from the accounts file
+# Function to load the accounts from the accounts file.  Read in binary
+# mode with a large buffer and hand the raw bytes to orjson, skipping the
+# text layer's UTF-8 decode pass entirely.
 def load_accounts():
     try:
-        with open('accounts.json') as file:
-            accounts = json.loads(file.read())
+        with open('accounts.json', 'rb', buffering=1 << 20) as file:
+            accounts = orjson.loads(file.read())
             return accounts
     except Exception as e:
         logging.error('Unable to load accounts file')
         logging.error('Error: ', exc_info=True)
 
-# Function to update the beneficiary in the accounts info
+# Function to update the beneficiary in the accounts info.  The file is
+# written to a sibling temp file and atomically renamed into place so a
+# concurrent reader never sees a truncated file and a crash mid-write
+# cannot lose the previous contents.
 def update_accounts(accounts):
     try:
-        with open('accounts.json', '+w') as file:
-            file.write(json.dumps(accounts))
+        fd, tmp = tempfile.mkstemp(dir='.', prefix='accounts.', suffix='.json')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(orjson.dumps(accounts))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, 'accounts.json')
     except Exception as e:
-        logging.error('Unable to load accounts file')
+        logging.error('Unable to update accounts file')
         logging.error('Error: ', exc_info=True)
 
+# In-memory view of accounts.json, keyed by email.  Requests read and
+# mutate this dict; a single background thread flushes it back to disk so
+# the request path never blocks on file I/O.
+#
+# The store is process-local and the writer flushes the whole snapshot,
+# so the app must run in exactly one process (see the gunicorn invocation
+# in the Dockerfile) — a second worker would never see this one's changes
+# and would overwrite them on its next flush.
+_ACCOUNTS_BY_EMAIL = {}
+_ACCOUNTS_LOCK = threading.RLock()
+_ACCOUNTS_DIRTY = queue.Queue()
+
+# Flag an account as changed so the writer thread persists it
+def mark_dirty(email):
+    _ACCOUNTS_DIRTY.put(email)
+
+# Background writer: wait for a dirty entry, coalesce any burst of updates
+# into a single snapshot, and write the whole file once
+def _accounts_writer():
+    while True:
+        _ACCOUNTS_DIRTY.get()
+        while True:
+            try:
+                _ACCOUNTS_DIRTY.get_nowait()
+            except queue.Empty:
+                break
+        with _ACCOUNTS_LOCK:
+            accounts = list(_ACCOUNTS_BY_EMAIL.values())
+        update_accounts(accounts)
+
+# Populate the in-memory store once at startup and start the writer
+for _account in (load_accounts() or []):
+    _ACCOUNTS_BY_EMAIL[_account['email']] = _account
+threading.Thread(target=_accounts_writer, daemon=True).start()
+
+# Process-local cache of the B2C signing keys so the authentication hot path
+# is a dict lookup instead of a network round trip.  Entries are keyed by
+# (TENANT_NAME, B2C_POLICY) and refreshed only when the TTL expires or a
+# token arrives with an unknown 'kid' (i.e. the tenant rotated its keys).
+JWKS_TTL_SECONDS = 3600
+JWKS_HARD_TTL_SECONDS = 24 * 3600
+JWKS_REFRESH_MIN_INTERVAL = 30
+
+# Single worker used to refresh a soft-expired JWKS in the background so
+# the request that notices the expiry still gets an immediate answer
+_JWKS_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+# Shared HTTP session so outbound calls reuse TCP connections and TLS
+# sessions instead of paying a fresh handshake on every JWKS refresh
+_HTTP = requests.Session()
+_HTTP.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+_JWKS_CACHE = {}
+_JWKS_LOCK = threading.Lock()
+
+# Derive the cache TTL from the Cache-Control max-age on the discovery
+# response, falling back to the configured default
+def _response_ttl(response):
+    max_age = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+    if max_age:
+        return int(max_age.group(1))
+    return JWKS_TTL_SECONDS
+
+# Fetch and parse the JWKS document for the tenant.  When we hold an ETag
+# from a previous fetch it is sent as If-None-Match; a 304 means the keys
+# are unchanged and is signalled by returning None for the document, so
+# the caller skips the JSON parse and key reconstruction.
+def _fetch_jwks(etag=None):
+    headers = {'If-None-Match': etag} if etag else None
+    response = _HTTP.get(JWKS_URL, timeout=(2, 5), headers=headers)
+    if response.status_code == 304:
+        return None, _response_ttl(response), etag
+    response.raise_for_status()
+    return response.json(), _response_ttl(response), response.headers.get('ETag')
+
+# Build the actual RSA public key object from a JWK entry once, so each
+# token verify skips the per-request key reconstruction from n and e
+def _build_public_key(key):
+    e = int.from_bytes(base64url_decode(key['e'].encode()), 'big')
+    n = int.from_bytes(base64url_decode(key['n'].encode()), 'big')
+    return rsa.RSAPublicNumbers(e, n).public_key(default_backend())
+
+# Fetch the JWKS and swap the parsed keys into the cache.  Runs either
+# inline (cold cache, hard expiry, forced refresh) or on the background
+# executor for stale-while-revalidate refreshes.
+def _refresh_jwks(cache_key):
+    with _JWKS_LOCK:
+        cache = _JWKS_CACHE.get(cache_key)
+        etag = cache.get('etag') if cache else None
+    try:
+        jwks, ttl, etag = _fetch_jwks(etag)
+        if jwks is None:
+            # 304: the keys did not change, just extend the cached entry
+            with _JWKS_LOCK:
+                cache = _JWKS_CACHE[cache_key]
+                cache['ts'] = time.monotonic()
+                cache['ttl'] = ttl
+                cache['last_refresh'] = cache['ts']
+                cache['in_flight'] = False
+                return cache['keys_by_kid']
+        keys_by_kid = {key['kid']: _build_public_key(key)
+                       for key in jwks['keys'] if key.get('kty') == 'RSA'}
+        with _JWKS_LOCK:
+            _JWKS_CACHE[cache_key] = {
+                'keys_by_kid': keys_by_kid,
+                'ts': time.monotonic(),
+                'ttl': ttl,
+                'last_refresh': time.monotonic(),
+                'etag': etag,
+                'in_flight': False
+            }
+        return keys_by_kid
+    except Exception:
+        with _JWKS_LOCK:
+            cache = _JWKS_CACHE.get(cache_key)
+            if cache:
+                cache['in_flight'] = False
+        raise
+
+# Background wrapper: a failed refresh is logged and retried on the next
+# soft-expired request instead of surfacing to any caller
+def _refresh_jwks_async(cache_key):
+    try:
+        _refresh_jwks(cache_key)
+    except Exception:
+        logging.warning('Background JWKS refresh failed', exc_info=True)
+
+# Return the tenant's signing keys pre-indexed as {kid: key}.  Within the
+# soft TTL this is a dict lookup; between the soft and hard TTLs the stale
+# keys are served while a background refresh runs; only past the hard TTL
+# (or on a forced refresh for an unknown kid) does a request block on the
+# fetch.  Forced refreshes are rate limited so a flood of bad tokens
+# cannot hammer the discovery endpoint.
+def _get_jwks(force=False):
+    cache_key = (TENANT_NAME, B2C_POLICY)
+    now = time.monotonic()
+    with _JWKS_LOCK:
+        cache = _JWKS_CACHE.get(cache_key)
+        if cache:
+            age = now - cache['ts']
+            if force:
+                if now - cache['last_refresh'] < JWKS_REFRESH_MIN_INTERVAL:
+                    return cache['keys_by_kid']
+            elif age < cache['ttl']:
+                return cache['keys_by_kid']
+            elif age < JWKS_HARD_TTL_SECONDS:
+                if not cache['in_flight']:
+                    cache['in_flight'] = True
+                    cache['last_refresh'] = now
+                    _JWKS_EXECUTOR.submit(_refresh_jwks_async, cache_key)
+                return cache['keys_by_kid']
+    return _refresh_jwks(cache_key)
+
+# Warm the JWKS cache during boot so the very first authenticated request
+# does not pay the discovery fetch; a failed warm-up is logged and the
+# keys are simply fetched lazily instead
+def _warm_jwks_cache():
+    try:
+        _get_jwks(force=True)
+    except Exception:
+        logging.warning('JWKS warm-up failed; keys will be fetched on the '
+                        'first authenticated request', exc_info=True)
+
+threading.Thread(target=_warm_jwks_cache, daemon=True).start()
+
+# If the warm-up thread has not finished by the time traffic arrives,
+# block once here rather than inside a request handler
+@app.before_first_request
+def _ensure_jwks_warm():
+    try:
+        _get_jwks()
+    except Exception:
+        logging.warning('JWKS warm-up failed; keys will be fetched on the '
+                        'first authenticated request', exc_info=True)
+
 # Error handler
 class AuthError(Exception):
     def __init__(self, error, status_code):
@@ -67,25 +276,58 @@ def get_token_auth_header():
                          "description":
                          "Authorization header is expected"}, 401)
 
-    parts = auth.split()
+    # Single-pass parse: split scheme from token without building a list
+    scheme, sep, token = auth.partition(' ')
 
-    if parts[0].lower() != "bearer":
+    if scheme.lower() != "bearer":
         raise AuthError({"code": "invalid_header",
                          "description":
                          "Authorization header must start with"
                          " Bearer"}, 401)
-    elif len(parts) == 1:
+    elif not sep or not token:
         raise AuthError({"code": "invalid_header",
                          "description": "Token not found"}, 401)
-    elif len(parts) > 2:
+    elif ' ' in token:
         raise AuthError({"code": "invalid_header",
                          "description":
                          "Authorization header must be"
                          " Bearer token"}, 401)
 
-    token = parts[1]
     return token
 
+# Verify the token's RS256 signature and claims directly against the
+# precomputed public key, skipping python-jose's per-request header/key
+# dispatch layers.  Raises AuthError with the same codes the jose-based
+# path produced.
+def _decode_token(token, public_key):
+    header_b64, payload_b64, sig_b64 = token.split('.')
+    signing_input = (header_b64 + '.' + payload_b64).encode()
+    try:
+        public_key.verify(base64url_decode(sig_b64.encode()),
+                          signing_input,
+                          padding.PKCS1v15(),
+                          hashes.SHA256())
+    except InvalidSignature:
+        raise AuthError({"code": "invalid_header",
+                         "description":
+                         "Unable to parse authentication"
+                         " token."}, 401)
+    payload = orjson.loads(base64url_decode(payload_b64.encode()))
+    now = time.time()
+    if 'exp' in payload and now >= payload['exp']:
+        raise AuthError({"code": "token_expired",
+                         "description": "token is expired"}, 401)
+    audience = payload.get('aud')
+    audiences = audience if isinstance(audience, list) else [audience]
+    if ('nbf' in payload and now < payload['nbf']
+            or CLIENT_ID not in audiences
+            or payload.get('iss') != ISSUER):
+        raise AuthError({"code": "invalid_claims",
+                         "description":
+                         "incorrect claims,"
+                         "please check the audience and issuer"}, 401)
+    return payload
+
 # Validat the access token by verifying the signature based upon the certificate used to sign it
 def requires_auth(f):
     """Determines if the Access Token is valid
@@ -94,22 +336,14 @@ def requires_auth(f):
     def decorated(*args, **kwargs):
         try:
             token = get_token_auth_header()
-            jsonurl = urlopen("https://" +
-                              TENANT_NAME + ".b2clogin.com/" +
-                              TENANT_NAME + ".onmicrosoft.com/" +
-                              B2C_POLICY + "/discovery/v2.0/keys")
-            jwks = json.loads(jsonurl.read())
             unverified_header = jwt.get_unverified_header(token)
-            rsa_key = {}
-            for key in jwks["keys"]:
-                if key["kid"] == unverified_header["kid"]:
-                    rsa_key = {
-                        "kty": key["kty"],
-                        "kid": key["kid"],
-                        "use": key["use"],
-                        "n": key["n"],
-                        "e": key["e"]
-                    }
+            keys = _get_jwks()
+            rsa_key = keys.get(unverified_header["kid"])
+            if rsa_key is None:
+                # An unknown kid usually means the tenant rotated its keys;
+                # refresh the cache once before rejecting the token
+                keys = _get_jwks(force=True)
+                rsa_key = keys.get(unverified_header["kid"])
         except Exception:
             raise AuthError({"code": "invalid_header",
                              "description":
@@ -117,28 +351,21 @@ def requires_auth(f):
                              " token."}, 401)
         if rsa_key:
             try:
-                payload = jwt.decode(
-                    token,
-                    rsa_key,
-                    algorithms=["RS256"],
-                    audience=CLIENT_ID,
-                    issuer="https://" + TENANT_NAME +
-                    ".b2clogin.com/" + TENANT_ID + "/v2.0/"
-                )
-            except jwt.ExpiredSignatureError:
-                raise AuthError({"code": "token_expired",
-                                 "description": "token is expired"}, 401)
-            except jwt.JWTClaimsError:
-                raise AuthError({"code": "invalid_claims",
-                                 "description":
-                                 "incorrect claims,"
-                                 "please check the audience and issuer"}, 401)
+                payload = _decode_token(token, rsa_key)
+            except AuthError:
+                raise
             except Exception:
                 raise AuthError({"code": "invalid_header",
                                  "description":
                                  "Unable to parse authentication"
                                  " token."}, 401)
             _request_ctx_stack.top.current_user = payload
+            # Keep the verified payload on g, along with the claims the
+            # handlers actually consume, so downstream helpers reuse them
+            # instead of re-decoding the same token
+            g.current_user = payload
+            g.token_scopes = set(payload.get("scp", "").split())
+            g.emails = payload.get("emails", [])
             return f(*args, **kwargs)
         raise AuthError({"code": "invalid_header",
                          "description": "Unable to find appropriate key"}, 401)
@@ -149,54 +376,55 @@ def requires_scope(required_scope):
     Args:
         required_scope (str): The scope required to access the resource
     """
-    token = get_token_auth_header()
-    unverified_claims = jwt.get_unverified_claims(token)
-    if unverified_claims.get("scp"):
-        token_scopes = unverified_claims["scp"].split()
-        for token_scope in token_scopes:
-            if token_scope == required_scope:
-                return True
-    return False
-
-# Retrieve the policy information from the accounts file
-def retrieve_policy_information():
-    token = get_token_auth_header()
-    unverified_claims = jwt.get_unverified_claims(token)
-    email_addresses = unverified_claims["emails"]
-    accounts = load_accounts()
-    for email in email_addresses:
-        for account in accounts:
-            if account['email'] == email:
-                return(account)
-        new_account = {
-            'beneficiary':'Homer Simpson',
-            'email': email,
-            'policynumber': randint(10000000,99999999)
-        }
-        accounts.append(new_account)       
-        update_accounts(accounts)
-        return(new_account)
+    return required_scope in g.token_scopes
+
+# Create an account for the given email, register it in the in-memory
+# store, and queue it for write-back
+def _create_new_account(email):
+    new_account = {
+        'beneficiary':'Homer Simpson',
+        'email': email,
+        'policynumber': randint(10000000,99999999)
+    }
+    with _ACCOUNTS_LOCK:
+        _ACCOUNTS_BY_EMAIL[email] = new_account
+    mark_dirty(email)
+    return new_account
 
+# Retrieve the policy information from the in-memory accounts store.
+# Not memoized: the lookup is already a dict hit and the beneficiary is
+# mutable, so a response cache here would serve stale data after updates.
+def retrieve_policy_information(email_addresses):
+    # A verified token may carry no emails claim at all; there is no
+    # account to look up or create in that case
+    if not email_addresses:
+        return "Record not found"
+    with _ACCOUNTS_LOCK:
+        hits = [email for email in email_addresses
+                if email in _ACCOUNTS_BY_EMAIL]
+        if hits:
+            return _ACCOUNTS_BY_EMAIL[hits[0]]
+    return _create_new_account(email_addresses[0])
 
-# Update the policy information in the accounts file
+
+# Update the policy information in the in-memory accounts store
 def update_policy_information(new_beneficiary):
-    token = get_token_auth_header()
-    unverified_claims = jwt.get_unverified_claims(token)
-    email_addresses = unverified_claims["emails"]
-    accounts = load_accounts()
-    for email in email_addresses:
-        for account in accounts:
-            if account['email'] == email:
+    email_addresses = g.emails
+    with _ACCOUNTS_LOCK:
+        for email in email_addresses:
+            account = _ACCOUNTS_BY_EMAIL.get(email)
+            if account:
                 account['beneficiary'] = new_beneficiary
-                update_accounts(accounts)
+                mark_dirty(email)
                 return 'Success'
-        return 'Error.  Unable to update'
+    return 'Error.  Unable to update'
 
 # Controllers API
 
 # This endpoint does not require authentication and is used to validate the API is reachable
 @app.route("/public")
 @cross_origin(allow_headers=['Content-Type', 'Authorization'])
+@cache.cached(timeout=3600)
 def public():
     response = "Successfully accessed the public API endpoint!"
     return response
@@ -207,10 +435,22 @@ def public():
 @requires_auth
 def acctinfo():
     if requires_scope("Accounts.Read"):
-        account = retrieve_policy_information()
+        account = retrieve_policy_information(g.emails)
         if account == "Record not found":
             return "Record not found", 400
-        return jsonify(account)
+        # Tag the response with a content hash so repeat polls can be
+        # answered with an empty 304 instead of re-sending the body.
+        # no-cache (rather than a max-age) makes clients revalidate on
+        # every use, so a beneficiary update is visible immediately.
+        body = orjson.dumps(account)
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        if request.if_none_match.contains(etag):
+            resp = app.response_class(status=304)
+        else:
+            resp = app.response_class(body, mimetype='application/json')
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+        return resp
     raise AuthError({
         "code": "Unauthorized",
         "description": "You don't have access to this resource"
@@ -232,5 +472,8 @@ def acctudpate():
         "description": "You don't have access to this resource"
     }, 403)
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0',port=5001)
+# The app is served by gunicorn with one threaded worker (see the Dockerfile):
+#   gunicorn -w 1 -k gthread --threads 16 -b 0.0.0.0:5001 app:app
+# The single-threaded Werkzeug dev server serialized every request behind
+# the previous one; a single worker is required because the accounts
+# store above is process-local.